@@ -0,0 +1,154 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+from io import BytesIO
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+# Static asset build
+# Copies static/ to a build directory under content-hashed names (dragon.png -> dragon.3f9c1e0a2b.png),
+# so a file's URL changes whenever it does and can be cached forever. Alongside each file it writes
+#   .gz / .br      precompressed copies of text assets (brotli only when the brotli package is installed)
+#   .webp          a WebP copy of each image, and
+#   -<width>w      smaller copies of wide images, for srcset (both of these need Pillow)
+# and a manifest.json mapping every source name to what was built for it.
+
+# editor sources and other files that are never served
+EXCLUDED = ('.psd',)
+COMPRESSIBLE = ('.css', '.js', '.svg', '.ico', '.json', '.txt', '.html')
+IMAGES = ('.png', '.jpg', '.jpeg')
+WIDTHS = (320, 640, 1280)
+CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+
+def excluded(filename):
+    return os.path.splitext(filename)[1].lower() in EXCLUDED
+
+
+def fingerprint(data):
+    return hashlib.sha256(data).hexdigest()[:10]
+
+
+def hashed_name(name, digest, suffix=''):
+    root, ext = os.path.splitext(name)
+    return '%s%s.%s%s' % (root, suffix, digest, ext)
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def compress(path, data):
+    write(path + '.gz', gzip.compress(data, 9))
+    if (brotli is not None):
+        write(path + '.br', brotli.compress(data))
+    return ['gzip'] + (['br'] if brotli is not None else [])
+
+
+def image_bytes(image, format):
+    buffer = BytesIO()
+    if (format == 'WEBP'):
+        image.save(buffer, format, quality=80, method=6)
+    elif (format == 'JPEG'):
+        image.convert('RGB').save(buffer, format, quality=85, optimize=True, progressive=True)
+    else:
+        image.save(buffer, format, optimize=True)
+    return buffer.getvalue()
+
+
+# WebP and resized copies of one image, entries go into its manifest record
+def image_variants(source, name, output_dir, entry):
+    with Image.open(source) as image:
+        image.load()
+        format = image.format
+        entry['width'] = image.width
+        webp = image_bytes(image, 'WEBP')
+        entry['webp'] = hashed_name(os.path.splitext(name)[0] + '.webp', fingerprint(webp))
+        write(os.path.join(output_dir, entry['webp']), webp)
+        entry['widths'] = {}
+        for width in WIDTHS:
+            if (width >= image.width):
+                continue
+            resized = image.resize((width, max(1, round(image.height * width / float(image.width)))), Image.LANCZOS)
+            data = image_bytes(resized, format)
+            webp = image_bytes(resized, 'WEBP')
+            entry['widths'][str(width)] = {
+                'file': hashed_name(name, fingerprint(data), '-%dw' % width),
+                'webp': hashed_name(os.path.splitext(name)[0] + '.webp', fingerprint(webp), '-%dw' % width),
+            }
+            write(os.path.join(output_dir, entry['widths'][str(width)]['file']), data)
+            write(os.path.join(output_dir, entry['widths'][str(width)]['webp']), webp)
+
+
+# stylesheets point at the hashed names of whatever they reference
+def rewrite_css(data, name, manifest):
+    base = os.path.dirname(name)
+
+    def replace(match):
+        quote, url = match.group(1), match.group(2)
+        if (':' in url or url.startswith('/')):
+            return match.group(0)
+        target = os.path.normpath(os.path.join(base, url)).replace(os.sep, '/')
+        if (target not in manifest):
+            return match.group(0)
+        return 'url(%s%s%s)' % (quote, os.path.relpath(manifest[target]['file'], base or '.').replace(os.sep, '/'),
+                                quote)
+
+    return CSS_URL.sub(replace, data.decode('utf-8')).encode('utf-8')
+
+
+def build(source_dir, output_dir):
+    if (os.path.isdir(output_dir)):
+        shutil.rmtree(output_dir)
+    names = []
+    for root, dirs, files in os.walk(source_dir):
+        # never pick up a previous build that lives inside the source directory
+        dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(root, d)) != os.path.abspath(output_dir)]
+        for filename in files:
+            name = os.path.relpath(os.path.join(root, filename), source_dir).replace(os.sep, '/')
+            if (not excluded(name)):
+                names.append(name)
+    # stylesheets last, so what they reference already has its hashed name
+    names.sort(key=lambda name: (name.lower().endswith('.css'), name))
+
+    manifest = {}
+    for name in names:
+        source = os.path.join(source_dir, name)
+        with open(source, 'rb') as f:
+            data = f.read()
+        ext = os.path.splitext(name)[1].lower()
+        if (ext == '.css'):
+            data = rewrite_css(data, name, manifest)
+        entry = {'file': hashed_name(name, fingerprint(data)), 'encodings': []}
+        path = os.path.join(output_dir, entry['file'])
+        write(path, data)
+        if (ext in COMPRESSIBLE):
+            entry['encodings'] = compress(path, data)
+        if (ext in IMAGES and Image is not None):
+            image_variants(source, name, output_dir, entry)
+        manifest[name] = entry
+
+    write(os.path.join(output_dir, 'manifest.json'), json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+def load_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, 'manifest.json')) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
@@ -0,0 +1,383 @@
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+import dice
+import stats
+
+
+# Benchmarks
+# Fills a scratch database with seeded synthetic users, campaigns and characters, then drives the
+# routes through the Flask test client, first one request at a time and then from concurrent workers.
+# Latency percentiles and SQL queries per request are reported per route, and can be saved as a
+# baseline and compared against on later runs:
+#   python bench.py --save-baseline bench_baseline.json
+#   python bench.py --baseline bench_baseline.json
+# DnD is imported only once the database is chosen, so the app never touches data.sqlite.
+
+PASSWORD = 'bench-password'
+
+RACES = ['Human', 'Half-Elf', 'Elf', 'Dwarf', 'Gnome', 'Halfling', 'Half-Orc']
+# class -> (hit die, saving throw proficiencies)
+CLASSES = {
+    'Barbarian': ('d12', ['str_save', 'con_save']), 'Bard': ('d8', ['dex_save', 'cha_save']),
+    'Cleric': ('d8', ['wis_save', 'cha_save']), 'Fighter': ('d10', ['str_save', 'con_save']),
+    'Monk': ('d8', ['str_save', 'dex_save']), 'Paladin': ('d10', ['wis_save', 'cha_save']),
+    'Ranger': ('d10', ['str_save', 'dex_save']), 'Rogue': ('d8', ['dex_save', 'int_save']),
+    'Sorcerer': ('d6', ['con_save', 'cha_save']), 'Wizard': ('d6', ['int_save', 'wis_save']),
+}
+NAMES = ['Aria', 'Bram', 'Cora', 'Dain', 'Elspeth', 'Fenwick', 'Garrick', 'Hilde', 'Ivo', 'Jessamy', 'Kael',
+         'Lorna', 'Merric', 'Nyx', 'Orrin', 'Pell', 'Quinn', 'Rook', 'Sable', 'Tamsin', 'Ulric', 'Vesna',
+         'Wren', 'Yorick', 'Zora']
+# experience needed for each level, 1-20
+LEVEL_EXP = [0, 300, 900, 2700, 6500, 14000, 23000, 34000, 48000, 64000, 85000, 100000, 120000, 140000,
+             165000, 195000, 225000, 265000, 305000, 355000]
+
+
+# One CharForm-valid record, in the same shape the bulk importer takes.
+# scores are six 4d6-drop-lowest rolls, everything else follows from class and level.
+def character_record(rng, name, scores):
+    cClass = rng.choice(sorted(CLASSES))
+    hit_dice, saves = CLASSES[cClass]
+    level = min(20, 1 + int(rng.expovariate(0.25)))
+    sides = int(hit_dice[1:])
+    con_mod = (scores[2] - 10) // 2
+    record = {
+        'name': name, 'race': rng.choice(RACES), 'cClass': cClass, 'level': level, 'hit_dice': hit_dice,
+        'total_hit_dice': level, 'exp_points': LEVEL_EXP[level - 1],
+        'armor_class': 10 + (scores[1] - 10) // 2 + rng.choice([0, 1, 2, 4, 6]),
+        'speed': 25 if rng.random() < 0.3 else 30,
+        'max_HP': max(level, sides + con_mod + (level - 1) * (sides // 2 + 1 + con_mod)),
+        'str': scores[0], 'dex': scores[1], 'con': scores[2], 'int': scores[3], 'wis': scores[4], 'cha': scores[5],
+    }
+    for save in saves:
+        record[save] = True
+    for skill in rng.sample(sorted(stats.SKILL_ABILITIES), rng.randint(2, 4)):
+        record[skill] = True
+    return record
+
+
+# Creates users player1..N, campaigns "Campaign 1".."Campaign M" and K characters spread over them.
+# Every user shares PASSWORD (hashed once, it's the same work to check either way).
+# Roughly one character in five is left out of any campaign.
+def generate(users, campaigns, characters, seed):
+    from DnD import app, db, User, Campaign, build_campaign_summaries, character_from_record, insert_batch, \
+        new_dice_seed
+    rng = random.Random(seed)
+
+    hashing = User()
+    hashing.set_password(PASSWORD)
+    db.session.bulk_insert_mappings(User, [{'username': 'player%d' % i, 'password_hash': hashing.password_hash}
+                                           for i in range(1, users + 1)])
+    db.session.bulk_insert_mappings(Campaign, [{'name': 'Campaign %d' % i, 'dice_seed': new_dice_seed()}
+                                               for i in range(1, campaigns + 1)])
+    db.session.commit()
+    user_ids = [u.id for u in User.query.with_entities(User.id).order_by(User.id)][-users:]
+    campaign_ids = [c.id for c in Campaign.query.with_entities(Campaign.id).order_by(Campaign.id)][-campaigns:]
+
+    rolls = dice.roll_many('4d6dl1', characters * 6, seed)
+    batch = []
+    errors = []
+    for i in range(characters):
+        name = '%s %d' % (rng.choice(NAMES), i + 1)
+        row, error = character_from_record(character_record(rng, name, rolls[i * 6:i * 6 + 6]), rng.choice(user_ids))
+        if (error is not None):
+            raise click.ClickException('Generated an invalid character: %s' % error)
+        if (campaign_ids and rng.random() < 0.8):
+            row['campaign_id'] = rng.choice(campaign_ids)
+        batch.append((i, row))
+        if (len(batch) >= app.config['IMPORT_BATCH_SIZE']):
+            insert_batch(batch, errors)
+            batch = []
+    if (batch):
+        insert_batch(batch, errors)
+    if (errors):
+        raise click.ClickException('Could not insert generated characters: %s' % errors[0]['errors'])
+    # bulk inserts skip the flush hooks that keep campaign summaries current
+    build_campaign_summaries()
+    db.session.commit()
+
+
+# Query counting
+# Counted per thread, each benchmark worker only ever has one request in flight.
+counter = threading.local()
+
+
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    counter.queries = getattr(counter, 'queries', 0) + 1
+
+
+# The data a scenario picks its targets from, loaded once after generating.
+class Sample(object):
+    def __init__(self, rng):
+        from DnD import User, Campaign, Character
+        self.rng = rng
+        self.users = [u.username for u in User.query.with_entities(User.username)
+                      if u.username.startswith('player')]
+        self.campaigns = [(c.id, c.name) for c in Campaign.query.with_entities(Campaign.id, Campaign.name)]
+        self.characters = [(c.id, c.name, c.user_id) for c in
+                           Character.query.with_entities(Character.id, Character.name, Character.user_id)]
+        owners = dict((u.id, u.username) for u in User.query.with_entities(User.id, User.username))
+        self.by_owner = {}
+        for id, name, user_id in self.characters:
+            self.by_owner.setdefault(owners.get(user_id), []).append(id)
+
+
+# A worker's test client, logged in as one player for the routes that need it.
+class Worker(object):
+    def __init__(self, app, sample, username):
+        self.sample = sample
+        self.rng = random.Random(sample.rng.random())
+        self.username = username
+        self.client = app.test_client()
+        login(self.client, username)
+        self.anonymous = app.test_client()
+
+
+def login(client, username):
+    response = client.post('/login', data={'username': username, 'password': PASSWORD})
+    if (response.status_code != 302 or '/user/' not in response.location):
+        raise click.ClickException('Could not log in as %s' % username)
+
+
+# Scenarios take a worker and return the response to time.
+# Each is (route, weight in the concurrent mix, function).
+def character(w):
+    id, name, user_id = w.rng.choice(w.sample.characters)
+    return w.client.get('/characters/%s' % name)
+
+
+def character_by_id(w):
+    id, name, user_id = w.rng.choice(w.sample.characters)
+    return w.anonymous.get('/characters/%d' % id)
+
+
+def user(w):
+    return w.anonymous.get('/user/%s' % w.rng.choice(w.sample.users))
+
+
+def character_list(w):
+    return w.client.get('/characters')
+
+
+def campaign(w):
+    id, name = w.rng.choice(w.sample.campaigns)
+    return w.anonymous.get('/campaigns/%s' % name)
+
+
+def campaign_list(w):
+    return w.client.get('/campaigns')
+
+
+def login_route(w):
+    w.anonymous.get('/logout')
+    return w.anonymous.post('/login', data={'username': w.username, 'password': PASSWORD})
+
+
+def add_character(w):
+    id, name = w.rng.choice(w.sample.campaigns)
+    return w.client.post('/%s/add-character' % name, data={'character': w.rng.choice(w.sample.by_owner[w.username])})
+
+
+def api_character(w):
+    id, name, user_id = w.rng.choice(w.sample.characters)
+    return w.anonymous.get('/api/v1/characters/%d' % id)
+
+
+def api_campaign(w):
+    id, name = w.rng.choice(w.sample.campaigns)
+    return w.anonymous.get('/api/v1/campaigns/%d' % id)
+
+
+def homepage(w):
+    return w.anonymous.get('/')
+
+
+SCENARIOS = [
+    ('homepage', 5, homepage),
+    ('character', 20, character),
+    ('character_by_id', 20, character_by_id),
+    ('user', 10, user),
+    ('character_list', 5, character_list),
+    ('campaign', 15, campaign),
+    ('campaign_list', 5, campaign_list),
+    ('login', 1, login_route),
+    ('add_character', 4, add_character),
+    ('api_character', 10, api_character),
+    ('api_campaign', 5, api_campaign),
+]
+# a request with one of these statuses counts as an error
+OK_STATUSES = (200, 302, 304)
+
+
+def timed(worker, scenario):
+    counter.queries = 0
+    start = time.perf_counter()
+    response = scenario(worker)
+    seconds = time.perf_counter() - start
+    return seconds, counter.queries, response.status_code in OK_STATUSES
+
+
+def percentile(values, p):
+    # nearest rank
+    ordered = sorted(values)
+    return ordered[max(0, int(math.ceil(p / 100.0 * len(ordered))) - 1)] if ordered else 0.0
+
+
+def summarize(samples):
+    results = {}
+    for route, rows in samples.items():
+        latencies = [seconds * 1000 for seconds, queries, ok in rows]
+        results[route] = {
+            'requests': len(rows),
+            'errors': sum(1 for seconds, queries, ok in rows if not ok),
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'queries': round(sum(queries for seconds, queries, ok in rows) / float(len(rows)), 2),
+        }
+    return results
+
+
+# every scenario `iterations` times in turn, from a single worker
+def run_sequential(workers, iterations):
+    worker = workers[0]
+    samples = {}
+    for route, weight, scenario in SCENARIOS:
+        # warm up once so the first request's template compile isn't in the numbers
+        scenario(worker)
+        samples[route] = [timed(worker, scenario) for i in range(iterations)]
+    return summarize(samples)
+
+
+# `requests` requests from every worker at once, routes picked by weight
+def run_concurrent(workers, requests):
+    routes = [route for route, weight, scenario in SCENARIOS]
+    weights = [weight for route, weight, scenario in SCENARIOS]
+    scenarios = dict((route, scenario) for route, weight, scenario in SCENARIOS)
+
+    def drive(worker):
+        rows = []
+        for route in worker.rng.choices(routes, weights, k=requests):
+            rows.append((route, timed(worker, scenarios[route])))
+        return rows
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(len(workers)) as pool:
+        results = list(pool.map(drive, workers))
+    elapsed = time.perf_counter() - start
+    samples = {}
+    for rows in results:
+        for route, row in rows:
+            samples.setdefault(route, []).append(row)
+    summary = summarize(samples)
+    summary['_total'] = {'requests': len(workers) * requests, 'seconds': round(elapsed, 3),
+                         'requests_per_second': round(len(workers) * requests / elapsed, 1)}
+    return summary
+
+
+def print_table(title, results):
+    click.echo(title)
+    click.echo('  %-18s %8s %6s %10s %10s %10s %8s' % ('route', 'requests', 'errors', 'p50 ms', 'p95 ms', 'p99 ms',
+                                                      'queries'))
+    for route, r in sorted(results.items()):
+        if (route.startswith('_')):
+            continue
+        click.echo('  %-18s %8d %6d %10.2f %10.2f %10.2f %8.2f' % (route, r['requests'], r['errors'], r['p50_ms'],
+                                                                r['p95_ms'], r['p99_ms'], r['queries']))
+    if ('_total' in results):
+        click.echo('  %(requests)d requests in %(seconds).2fs, %(requests_per_second).1f/s' % results['_total'])
+
+
+# Compares against a saved run. A route regresses when its p95 is more than `tolerance` slower or it
+# makes more queries per request than before; query counts are exact, timings are noisy.
+def compare(results, baseline, tolerance):
+    regressions = []
+    for mode in ('sequential', 'concurrent'):
+        for route, r in sorted(results.get(mode, {}).items()):
+            before = baseline.get(mode, {}).get(route)
+            if (route.startswith('_') or before is None):
+                continue
+            if (r['p95_ms'] > before['p95_ms'] * (1 + tolerance)):
+                regressions.append('%s %s: p95 %.2fms -> %.2fms' % (mode, route, before['p95_ms'], r['p95_ms']))
+            if (r['queries'] > before['queries']):
+                regressions.append('%s %s: %.2f -> %.2f queries per request'
+                                   % (mode, route, before['queries'], r['queries']))
+            if (r['errors'] > before['errors']):
+                regressions.append('%s %s: %d -> %d errors' % (mode, route, before['errors'], r['errors']))
+    return regressions
+
+
+@click.command()
+@click.option('--users', default=50, help='Synthetic users to create.')
+@click.option('--campaigns', default=20, help='Synthetic campaigns to create.')
+@click.option('--characters', default=2000, help='Synthetic characters to create.')
+@click.option('--seed', default=1, help='Seed for the generated data and the request mix.')
+@click.option('--iterations', default=50, help='Requests per route in the sequential run.')
+@click.option('--workers', default=8, help='Concurrent workers.')
+@click.option('--requests', default=100, help='Requests per worker in the concurrent run.')
+@click.option('--database', default=None, help='Database URL to fill, a temporary SQLite file by default.')
+@click.option('--output', type=click.Path(), default=None, help='Write the results here as JSON.')
+@click.option('--save-baseline', type=click.Path(), default=None, help='Write the results as the new baseline.')
+@click.option('--baseline', type=click.Path(exists=True), default=None, help='Compare against this baseline.')
+@click.option('--tolerance', default=0.25, help='Allowed p95 slowdown against the baseline, 0.25 is 25%.')
+def main(users, campaigns, characters, seed, iterations, workers, requests, database, output, save_baseline,
+         baseline, tolerance):
+    """Generate synthetic data and benchmark every route against it."""
+    scratch = None
+    if (database is None):
+        handle, scratch = tempfile.mkstemp(prefix='dnd-bench-', suffix='.sqlite')
+        os.close(handle)
+        database = 'sqlite:///' + scratch
+    os.environ['DATABASE_URL'] = database
+    from sqlalchemy import event
+    from DnD import app, db, upgrade_db
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    try:
+        with app.app_context():
+            upgrade_db()
+            click.echo('Generating %d users, %d campaigns, %d characters' % (users, campaigns, characters))
+            generate(users, campaigns, characters, seed)
+            event.listen(db.engine, 'before_cursor_execute', count_query)
+            sample = Sample(random.Random(seed))
+        # players with characters, so add_character always has one to move
+        players = [name for name in sample.users if sample.by_owner.get(name)]
+        pool = [Worker(app, sample, players[i % len(players)]) for i in range(workers)]
+
+        results = {'options': {'users': users, 'campaigns': campaigns, 'characters': characters, 'seed': seed,
+                               'iterations': iterations, 'workers': workers, 'requests': requests}}
+        results['sequential'] = run_sequential(pool, iterations)
+        print_table('Sequential, %d requests per route' % iterations, results['sequential'])
+        results['concurrent'] = run_concurrent(pool, requests)
+        print_table('Concurrent, %d workers x %d requests' % (workers, requests), results['concurrent'])
+    finally:
+        if (scratch is not None):
+            for suffix in ('', '-wal', '-shm'):
+                if (os.path.exists(scratch + suffix)):
+                    os.remove(scratch + suffix)
+
+    for path in (output, save_baseline):
+        if (path is not None):
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+    if (baseline is not None):
+        with open(baseline) as f:
+            regressions = compare(results, json.load(f), tolerance)
+        for regression in regressions:
+            click.echo('REGRESSION ' + regression)
+        if (regressions):
+            sys.exit(1)
+        click.echo('No regressions against ' + baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+# Cache for rendered page fragments.
+# Entries are stored per key along with a version, so a lookup with a newer version is a miss.
+# Memory is the default backend, pass a directory to keep entries on disk instead.
+class FragmentCache(object):
+    def __init__(self, max_entries=1024, max_bytes=None, directory=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()   # key -> (version, size), least recently used first
+        self._values = {}               # key -> html, memory backend only
+        self._bytes = 0
+        self._lock = threading.Lock()
+        if (directory is not None):
+            self._load_directory()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if (entry is None or entry[0] != version):
+                self.misses += 1
+                return None
+            value = self._read(key, version)
+            if (value is None):
+                # the file is gone or another process has written a different version over it,
+                # either way it isn't ours to delete
+                version, size = self._entries.pop(key)
+                self._bytes -= size
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, version, value):
+        size = len(value.encode('utf-8'))
+        with self._lock:
+            if (key in self._entries):
+                self._remove(key)
+            if (self.max_bytes is not None and size > self.max_bytes):
+                return
+            self._write(key, version, value)
+            self._entries[key] = (version, size)
+            self._bytes += size
+            while (len(self._entries) > self.max_entries or
+                   (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            if (key in self._entries):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self._entries), 'bytes': self._bytes}
+
+    # backend helpers, called with the lock held
+    def _path(self, key):
+        return os.path.join(self.directory, '%s.html' % key)
+
+    def _read(self, key, version):
+        if (self.directory is None):
+            return self._values.get(key)
+        try:
+            with open(self._path(key), encoding='utf-8') as f:
+                # processes sharing the directory each keep their own index, so trust the file's header
+                if (f.readline().strip() != str(version)):
+                    return None
+                return f.read()
+        except IOError:
+            return None
+
+    def _write(self, key, version, value):
+        if (self.directory is None):
+            self._values[key] = value
+            return
+        # write to a temp file first so a reader never sees half an entry
+        temp = '%s.%d.tmp' % (self._path(key), os.getpid())
+        with open(temp, 'w', encoding='utf-8') as f:
+            f.write('%s\n' % version)
+            f.write(value)
+        os.replace(temp, self._path(key))
+
+    def _remove(self, key):
+        version, size = self._entries.pop(key)
+        self._bytes -= size
+        if (self.directory is None):
+            self._values.pop(key, None)
+            return
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _load_directory(self):
+        if (not os.path.isdir(self.directory)):
+            os.makedirs(self.directory)
+        files = [f for f in os.listdir(self.directory) if f.endswith('.html')]
+        files.sort(key=lambda f: os.path.getmtime(os.path.join(self.directory, f)))
+        for filename in files:
+            path = os.path.join(self.directory, filename)
+            key = filename[:-len('.html')]
+            if (key.isdigit()):
+                key = int(key)
+            with open(path, encoding='utf-8') as f:
+                header = f.readline()
+            version = header.strip()
+            size = os.path.getsize(path) - len(header.encode('utf-8'))
+            self._entries[key] = (int(version) if version.isdigit() else version, size)
+            self._bytes += size
+
+
+# Small in-memory cache whose entries expire ttl seconds after they're set.
+# For values that are cheap to reload but looked up on nearly every request.
+class TTLCache(object):
+    def __init__(self, max_entries=1024, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()   # key -> (expires, value), least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if (entry is None or entry[0] <= time.monotonic()):
+                if (entry is not None):
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            while (len(self._entries) > self.max_entries):
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self._entries)}
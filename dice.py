@@ -0,0 +1,179 @@
+import random
+import re
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Dice expressions
+#   4d6kh3+2    four d6, keep the highest three, add two
+#   d20adv      roll twice and keep the higher (dis keeps the lower)
+#   2d20kl1     keep lowest, dh/dl drop highest/lowest instead
+#   3d6!        exploding - every die that rolls its maximum is rolled again and added
+#   2d8+1d6-1   any number of dice and constant terms joined by + and -
+
+MAX_DICE = 1000         # dice in one term
+MAX_SIDES = 1000
+MAX_EXPLOSIONS = 100    # rerolls of a single exploding die
+MAX_LENGTH = 100        # characters in one expression
+
+TERM = re.compile(r'([+-])?(?:(\d*)d(\d+)(adv|dis)?(?:(kh|kl|dh|dl)(\d+))?(!)?|(\d+))')
+
+
+class DiceError(ValueError):
+    pass
+
+
+class DiceTerm(object):
+    __slots__ = ('sign', 'count', 'sides', 'keep', 'keep_highest', 'explode')
+
+    def __init__(self, sign, count, sides, keep=None, keep_highest=True, explode=False):
+        self.sign = sign
+        self.count = count
+        self.sides = sides
+        self.keep = keep                # number of dice kept, None keeps them all
+        self.keep_highest = keep_highest
+        self.explode = explode
+
+
+class Expression(object):
+    def __init__(self, text, terms, constant):
+        self.text = text
+        self.terms = terms
+        self.constant = constant
+
+    def __str__(self):
+        return self.text
+
+    # dice rolled for one result, before any explode
+    def dice(self):
+        return sum(term.count for term in self.terms)
+
+
+def parse(text):
+    source = text.replace(' ', '').lower()
+    if (not source):
+        raise DiceError('Empty dice expression')
+    if (len(source) > MAX_LENGTH):
+        raise DiceError('Dice expressions can be at most %d characters' % MAX_LENGTH)
+    terms = []
+    constant = 0
+    position = 0
+    while (position < len(source)):
+        match = TERM.match(source, position)
+        if (match is None or match.end() == position or (position > 0 and match.group(1) is None)):
+            raise DiceError('Invalid dice expression at "%s"' % source[position:])
+        sign = -1 if match.group(1) == '-' else 1
+        if (match.group(8) is not None):
+            constant += sign * int(match.group(8))
+        else:
+            terms.append(parse_dice(sign, match))
+        position = match.end()
+    return Expression(text, terms, constant)
+
+
+def parse_dice(sign, match):
+    count = int(match.group(2)) if match.group(2) else 1
+    sides = int(match.group(3))
+    advantage, keep_rule, keep_count, explode = match.group(4), match.group(5), match.group(6), match.group(7)
+    if (not 1 <= count <= MAX_DICE):
+        raise DiceError('Between 1 and %d dice can be rolled at once' % MAX_DICE)
+    if (not 1 <= sides <= MAX_SIDES):
+        raise DiceError('Dice must have between 1 and %d sides' % MAX_SIDES)
+    if (explode and sides == 1):
+        raise DiceError('A d1 can not explode')
+    keep = None
+    keep_highest = True
+    if (advantage is not None):
+        if (keep_rule is not None or count != 1):
+            raise DiceError('adv/dis only applies to a single die')
+        count, keep, keep_highest = 2, 1, advantage == 'adv'
+    elif (keep_rule is not None):
+        n = int(keep_count)
+        if (n > count):
+            raise DiceError('Can not keep or drop more dice than are rolled')
+        if (keep_rule == 'kh'):
+            keep, keep_highest = n, True
+        elif (keep_rule == 'kl'):
+            keep, keep_highest = n, False
+        elif (keep_rule == 'dh'):
+            keep, keep_highest = count - n, False
+        else:
+            keep, keep_highest = count - n, True
+    return DiceTerm(sign, count, sides, keep, keep_highest, bool(explode))
+
+
+def engine():
+    return 'numpy' if numpy is not None else 'python'
+
+
+# Rolls an expression `count` times and returns the totals as a list.
+# The same seed always gives the same totals on the same engine, so a seeded roll can be replayed.
+def roll_many(expression, count, seed=None):
+    if (isinstance(expression, str)):
+        expression = parse(expression)
+    if (numpy is not None):
+        return roll_numpy(expression, count, seed)
+    return roll_python(expression, count, seed)
+
+
+def roll(expression, seed=None):
+    return roll_many(expression, 1, seed)[0]
+
+
+def roll_python(expression, count, seed):
+    rng = random.Random(seed_key(seed)) if seed is not None else random.SystemRandom()
+    totals = []
+    for i in range(count):
+        total = expression.constant
+        for term in expression.terms:
+            dice = []
+            for d in range(term.count):
+                value = rng.randint(1, term.sides)
+                die = value
+                explosions = 0
+                while (term.explode and value == term.sides and explosions < MAX_EXPLOSIONS):
+                    value = rng.randint(1, term.sides)
+                    die += value
+                    explosions += 1
+                dice.append(die)
+            if (term.keep is not None):
+                dice.sort(reverse=term.keep_highest)
+                dice = dice[:term.keep]
+            total += term.sign * sum(dice)
+        totals.append(total)
+    return totals
+
+
+def roll_numpy(expression, count, seed):
+    rng = numpy.random.default_rng(seed)
+    totals = numpy.full(count, expression.constant, dtype=numpy.int64)
+    for term in expression.terms:
+        dice = rng.integers(1, term.sides + 1, size=(count, term.count))
+        if (term.explode):
+            # keep rerolling only the dice that are still on their maximum
+            live = dice == term.sides
+            for explosion in range(MAX_EXPLOSIONS):
+                if (not live.any()):
+                    break
+                extra = rng.integers(1, term.sides + 1, size=int(live.sum()))
+                dice[live] += extra
+                still = numpy.zeros_like(live)
+                still[live] = extra == term.sides
+                live = still
+        if (term.keep == 0):
+            continue
+        if (term.keep is not None):
+            dice.sort(axis=1)
+            dice = dice[:, -term.keep:] if term.keep_highest else dice[:, :term.keep]
+        totals += term.sign * dice.sum(axis=1)
+    return totals.tolist()
+
+
+def seed_key(seed):
+    # random.Random only takes one value, numpy takes the sequence as is
+    if (isinstance(seed, (list, tuple))):
+        return ':'.join(str(s) for s in seed)
+    return seed
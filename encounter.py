@@ -0,0 +1,199 @@
+import heapq
+import itertools
+
+
+# Combat state for one running encounter.
+# Turn order is a heap on (-initiative, -dex modifier, join order), so taking the next turn or
+# adding a combatant is O(log n), and looking a combatant up to apply damage/healing is O(1).
+# Nothing here touches the database, HP changes are marked dirty until the app checkpoints them.
+# to_state()/from_state() turn the whole thing, turn order included, into plain JSON-able data so
+# the app can store it between requests.
+
+class Combatant(object):
+    __slots__ = ('key', 'character_id', 'name', 'initiative', 'dex_mod', 'hp', 'max_hp', 'temp_hp',
+                 'conditions', 'removed', 'dirty')
+
+    def __init__(self, key, name, initiative, hp, max_hp, temp_hp=0, dex_mod=0, character_id=None):
+        self.key = key
+        self.character_id = character_id
+        self.name = name
+        self.initiative = initiative
+        self.dex_mod = dex_mod
+        self.hp = hp
+        self.max_hp = max_hp
+        self.temp_hp = temp_hp
+        self.conditions = set()
+        self.removed = False
+        self.dirty = False
+
+    def sort_key(self, sequence):
+        return (-self.initiative, -self.dex_mod, sequence)
+
+    def to_dict(self):
+        return {'key': self.key, 'character_id': self.character_id, 'name': self.name,
+                'initiative': self.initiative, 'hp': self.hp, 'max_hp': self.max_hp, 'temp_hp': self.temp_hp,
+                'conditions': sorted(self.conditions)}
+
+    def to_state(self):
+        return dict(self.to_dict(), dex_mod=self.dex_mod, removed=self.removed, dirty=self.dirty)
+
+    @classmethod
+    def from_state(cls, state):
+        combatant = cls(state['key'], state['name'], state['initiative'], state['hp'], state['max_hp'],
+                        temp_hp=state['temp_hp'], dex_mod=state['dex_mod'], character_id=state['character_id'])
+        combatant.conditions = set(state['conditions'])
+        combatant.removed = state['removed']
+        combatant.dirty = state['dirty']
+        return combatant
+
+
+class EncounterError(ValueError):
+    pass
+
+
+def check_amount(amount):
+    # damage can't heal and healing can't hurt
+    if (amount < 0):
+        raise EncounterError('amount must not be negative')
+    return amount
+
+
+class Encounter(object):
+    def __init__(self, campaign_id):
+        self.campaign_id = campaign_id
+        self.round = 1
+        self.current = None
+        self.started = False
+        self.combatants = {}        # key -> Combatant
+        self._waiting = []          # heap of combatants still to act this round
+        self._acted = []            # heap entries that have acted, they make up next round's heap
+        self._sequence = itertools.count()
+
+    def add(self, combatant):
+        if (combatant.key in self.combatants and not self.combatants[combatant.key].removed):
+            raise EncounterError('%s is already in the encounter' % combatant.name)
+        self.combatants[combatant.key] = combatant
+        entry = (combatant.sort_key(next(self._sequence)), combatant)
+        # joins this round if they'd have come up after whoever is acting now, otherwise next round
+        if (self.current is None or entry[0] > self.combatants[self.current].sort_key(-1)):
+            heapq.heappush(self._waiting, entry)
+        else:
+            heapq.heappush(self._acted, entry)
+        return combatant
+
+    def remove(self, key):
+        # lazy deletion, the heap entry is skipped when it comes up (entries hold the combatant
+        # itself, so someone removed and added back doesn't get their old entry too)
+        combatant = self.get(key)
+        combatant.removed = True
+        if (self.current == key):
+            self.current = None
+
+    def get(self, key):
+        combatant = self.combatants.get(key)
+        if (combatant is None or combatant.removed):
+            raise EncounterError('No combatant %s' % key)
+        return combatant
+
+    # Advances to the next combatant. Returns True when that started a new round.
+    def next_turn(self):
+        if (self.current is not None):
+            current = self.combatants[self.current]
+            heapq.heappush(self._acted, (current.sort_key(next(self._sequence)), current))
+            self.current = None
+        new_round = False
+        while (True):
+            if (not self._waiting):
+                if (not self._acted):
+                    return new_round
+                self._waiting, self._acted = self._acted, []
+                heapq.heapify(self._waiting)
+                if (self.started):
+                    self.round += 1
+                    new_round = True
+            sort_key, combatant = heapq.heappop(self._waiting)
+            if (not combatant.removed):
+                self.current = combatant.key
+                self.started = True
+                return new_round
+
+    def damage(self, key, amount):
+        check_amount(amount)
+        combatant = self.get(key)
+        absorbed = min(combatant.temp_hp, amount)
+        combatant.temp_hp -= absorbed
+        combatant.hp = max(0, combatant.hp - (amount - absorbed))
+        combatant.dirty = True
+        return combatant
+
+    def heal(self, key, amount):
+        check_amount(amount)
+        combatant = self.get(key)
+        combatant.hp = min(combatant.max_hp, combatant.hp + amount) if combatant.max_hp else combatant.hp + amount
+        combatant.dirty = True
+        return combatant
+
+    def set_temp_hp(self, key, amount):
+        # temporary hit points don't stack, the larger amount wins
+        check_amount(amount)
+        combatant = self.get(key)
+        combatant.temp_hp = max(combatant.temp_hp, amount)
+        combatant.dirty = True
+        return combatant
+
+    def add_condition(self, key, condition):
+        combatant = self.get(key)
+        combatant.conditions.add(condition)
+        return combatant
+
+    def remove_condition(self, key, condition):
+        combatant = self.get(key)
+        combatant.conditions.discard(condition)
+        return combatant
+
+    def order(self):
+        # waiting this round in turn order, then everyone who has already acted
+        upcoming = [c.key for sort_key, c in sorted(self._waiting, key=lambda entry: entry[0]) if not c.removed]
+        acted = [c.key for sort_key, c in sorted(self._acted, key=lambda entry: entry[0]) if not c.removed]
+        current = [self.current] if self.current is not None else []
+        return current + upcoming + acted
+
+    # characters whose HP changed since the last checkpoint, marked clean
+    def take_dirty(self):
+        dirty = [c for c in self.combatants.values() if c.dirty and c.character_id is not None]
+        for combatant in dirty:
+            combatant.dirty = False
+        return dirty
+
+    # heap entries of removed combatants are dropped rather than stored, they'd only be skipped
+    def to_state(self):
+        def entries(heap):
+            return [[sort_key[2], c.key] for sort_key, c in heap if not c.removed]
+        return {'campaign_id': self.campaign_id, 'round': self.round, 'current': self.current,
+                'started': self.started, 'sequence': next(self._sequence),
+                'combatants': [c.to_state() for c in self.combatants.values()],
+                'waiting': entries(self._waiting), 'acted': entries(self._acted)}
+
+    @classmethod
+    def from_state(cls, state):
+        encounter = cls(state['campaign_id'])
+        encounter.round = state['round']
+        encounter.current = state['current']
+        encounter.started = state['started']
+        encounter._sequence = itertools.count(state['sequence'])
+        for combatant_state in state['combatants']:
+            combatant = Combatant.from_state(combatant_state)
+            encounter.combatants[combatant.key] = combatant
+
+        def heap(entries):
+            heap = [(encounter.combatants[key].sort_key(sequence), encounter.combatants[key])
+                    for sequence, key in entries]
+            heapq.heapify(heap)
+            return heap
+        encounter._waiting = heap(state['waiting'])
+        encounter._acted = heap(state['acted'])
+        return encounter
+
+    def to_dict(self):
+        return {'campaign_id': self.campaign_id, 'round': self.round, 'current': self.current,
+                'combatants': [self.combatants[key].to_dict() for key in self.order()]}
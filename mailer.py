@@ -0,0 +1,207 @@
+import heapq
+import itertools
+import smtplib
+import socket
+import threading
+import time
+from email.message import EmailMessage
+
+
+# Background email delivery
+# Messages are queued and sent by a few worker threads, each holding one SMTP connection open
+# between messages (and dropping it after idle_timeout seconds with nothing to send).
+# Temporary failures (4xx replies, lost connections) are retried with exponential backoff,
+# permanent ones (5xx) are dropped. A token bucket keeps the send rate under rate_limit per second.
+
+class Mail(object):
+    __slots__ = ('to', 'subject', 'body', 'attempts')
+
+    def __init__(self, to, subject, body):
+        self.to = to
+        self.subject = subject
+        self.body = body
+        self.attempts = 0
+
+
+class RateLimiter(object):
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(1, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    # blocks until a message may be sent
+    def acquire(self):
+        while (True):
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if (self._tokens >= 1):
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def permanent_failure(error):
+    # anything that isn't the server or the network (a header that won't encode) fails the same way every time
+    if (not isinstance(error, (smtplib.SMTPException, socket.error))):
+        return True
+    if (isinstance(error, smtplib.SMTPRecipientsRefused)):
+        return all(code >= 500 for code, message in error.recipients.values())
+    if (isinstance(error, smtplib.SMTPResponseException)):
+        return error.smtp_code >= 500
+    return False
+
+
+class MailQueue(object):
+    def __init__(self, host, port, sender, username=None, password=None, use_tls=False, workers=2,
+                 max_retries=5, backoff=2.0, rate_limit=5, idle_timeout=30, timeout=10):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.limiter = RateLimiter(rate_limit)
+        self.counts = {'sent': 0, 'failed': 0, 'retried': 0}
+        self._heap = []             # (due time, sequence, mail)
+        self._sequence = itertools.count()
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._threads = []
+        self._stopping = False
+
+    # queues messages to be sent as soon as a worker is free, returns how many were queued
+    def enqueue(self, mails):
+        now = time.monotonic()
+        with self._condition:
+            for mail in mails:
+                heapq.heappush(self._heap, (now, next(self._sequence), mail))
+            self._start_workers()
+            self._condition.notify_all()
+        return len(mails)
+
+    def stats(self):
+        with self._condition:
+            return dict(self.counts, pending=len(self._heap) + self._in_flight)
+
+    # waits up to timeout seconds for everything queued so far to be sent or given up on
+    def join(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while (self._heap or self._in_flight):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if (remaining is not None and remaining <= 0):
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._stopping = False
+
+    def _start_workers(self):
+        self._threads = [t for t in self._threads if t.is_alive()]
+        while (len(self._threads) < self.workers):
+            thread = threading.Thread(target=self._work, name='mail-worker', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    # the next mail that's due, or None once the connection has sat idle too long or the queue is stopping
+    def _next(self):
+        idle_until = time.monotonic() + self.idle_timeout
+        with self._condition:
+            while (not self._stopping):
+                now = time.monotonic()
+                if (self._heap and self._heap[0][0] <= now):
+                    due, sequence, mail = heapq.heappop(self._heap)
+                    self._in_flight += 1
+                    return mail
+                if (now >= idle_until):
+                    return None
+                wait = idle_until - now
+                if (self._heap):
+                    wait = min(wait, self._heap[0][0] - now)
+                self._condition.wait(wait)
+        return None
+
+    def _done(self, mail, error):
+        with self._condition:
+            self._in_flight -= 1
+            if (error is None):
+                self.counts['sent'] += 1
+            elif (permanent_failure(error) or mail.attempts > self.max_retries):
+                self.counts['failed'] += 1
+            else:
+                self.counts['retried'] += 1
+                due = time.monotonic() + self.backoff * 2 ** (mail.attempts - 1)
+                heapq.heappush(self._heap, (due, next(self._sequence), mail))
+            self._condition.notify_all()
+
+    def _connect(self):
+        connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if (self.use_tls):
+            connection.starttls()
+        if (self.username):
+            connection.login(self.username, self.password)
+        return connection
+
+    def _work(self):
+        connection = None
+        try:
+            while (True):
+                mail = self._next()
+                if (mail is None):
+                    # idle or stopping, a new worker is started with the next enqueue
+                    break
+                self.limiter.acquire()
+                mail.attempts += 1
+                error = None
+                try:
+                    message = EmailMessage()
+                    message['From'] = self.sender
+                    message['To'] = mail.to
+                    message['Subject'] = mail.subject
+                    message.set_content(mail.body)
+                    if (connection is None):
+                        connection = self._connect()
+                    connection.send_message(message)
+                except (smtplib.SMTPException, socket.error) as e:
+                    error = e
+                    # a refused recipient leaves the connection usable, anything else gets a fresh one
+                    if (not isinstance(e, smtplib.SMTPRecipientsRefused) and connection is not None):
+                        close(connection)
+                        connection = None
+                except Exception as e:
+                    # counted as failed rather than taking the worker (and its in-flight count) down with it
+                    error = e
+                self._done(mail, error)
+        finally:
+            if (connection is not None):
+                close(connection)
+            with self._condition:
+                if (threading.current_thread() in self._threads):
+                    self._threads.remove(threading.current_thread())
+                # mail can arrive between deciding to stop and leaving the worker list
+                if (self._heap and not self._stopping):
+                    self._start_workers()
+
+
+def close(connection):
+    try:
+        connection.quit()
+    except (smtplib.SMTPException, socket.error):
+        connection.close()
@@ -0,0 +1,75 @@
+import heapq
+import threading
+
+
+# Request and query timings, kept in memory and exported in the Prometheus text format.
+class RequestMetrics(object):
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, slow_queries=20):
+        self.slow_query_count = slow_queries
+        self._lock = threading.Lock()
+        self._requests = {}     # (endpoint, method, status) -> count
+        self._durations = {}    # endpoint -> [count per bucket..., +Inf count, sum]
+        self._sql = {}          # endpoint -> [queries, seconds]
+        self._templates = {}    # endpoint -> seconds
+        self._slowest = []      # min-heap of (seconds, statement)
+
+    def observe_request(self, endpoint, method, status, seconds, queries, sql_seconds, template_seconds):
+        with self._lock:
+            key = (endpoint, method, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            histogram = self._durations.setdefault(endpoint, [0] * (len(self.BUCKETS) + 2))
+            for i, bound in enumerate(self.BUCKETS):
+                if (seconds <= bound):
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+            sql = self._sql.setdefault(endpoint, [0, 0.0])
+            sql[0] += queries
+            sql[1] += sql_seconds
+            self._templates[endpoint] = self._templates.get(endpoint, 0.0) + template_seconds
+
+    def observe_query(self, statement, seconds):
+        with self._lock:
+            entry = (seconds, statement)
+            if (len(self._slowest) < self.slow_query_count):
+                heapq.heappush(self._slowest, entry)
+            elif (seconds > self._slowest[0][0]):
+                heapq.heapreplace(self._slowest, entry)
+
+    def slow_queries(self):
+        with self._lock:
+            return [{'seconds': seconds, 'statement': statement}
+                    for seconds, statement in sorted(self._slowest, reverse=True)]
+
+    def render(self, counters=None, gauges=None):
+        lines = []
+        with self._lock:
+            lines.append('# TYPE dnd_requests_total counter')
+            for (endpoint, method, status), count in sorted(self._requests.items()):
+                lines.append('dnd_requests_total{endpoint="%s",method="%s",status="%s"} %d'
+                             % (endpoint, method, status, count))
+            lines.append('# TYPE dnd_request_duration_seconds histogram')
+            for endpoint, histogram in sorted(self._durations.items()):
+                for bound, count in zip(self.BUCKETS, histogram):
+                    lines.append('dnd_request_duration_seconds_bucket{endpoint="%s",le="%s"} %d'
+                                 % (endpoint, bound, count))
+                lines.append('dnd_request_duration_seconds_bucket{endpoint="%s",le="+Inf"} %d'
+                             % (endpoint, histogram[-2]))
+                lines.append('dnd_request_duration_seconds_count{endpoint="%s"} %d' % (endpoint, histogram[-2]))
+                lines.append('dnd_request_duration_seconds_sum{endpoint="%s"} %.6f' % (endpoint, histogram[-1]))
+            lines.append('# TYPE dnd_sql_queries_total counter')
+            for endpoint, (queries, seconds) in sorted(self._sql.items()):
+                lines.append('dnd_sql_queries_total{endpoint="%s"} %d' % (endpoint, queries))
+            lines.append('# TYPE dnd_sql_duration_seconds_total counter')
+            for endpoint, (queries, seconds) in sorted(self._sql.items()):
+                lines.append('dnd_sql_duration_seconds_total{endpoint="%s"} %.6f' % (endpoint, seconds))
+            lines.append('# TYPE dnd_template_render_seconds_total counter')
+            for endpoint, seconds in sorted(self._templates.items()):
+                lines.append('dnd_template_render_seconds_total{endpoint="%s"} %.6f' % (endpoint, seconds))
+        for kind, values in (('counter', counters), ('gauge', gauges)):
+            for name, value in sorted((values or {}).items()):
+                lines.append('# TYPE dnd_%s %s' % (name, kind))
+                lines.append('dnd_%s %s' % (name, value))
+        return '\n'.join(lines) + '\n'
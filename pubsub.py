@@ -0,0 +1,115 @@
+import queue
+import threading
+import time
+
+
+# A subscriber's view of one channel. Messages are read with get(), which returns None on timeout.
+# If the subscriber falls more than max_pending messages behind it is marked overflowed and
+# should reconnect rather than carry on with a gap in what it has seen.
+class Subscription(object):
+    def __init__(self, broker, channel, max_pending):
+        self.broker = broker
+        self.channel = channel
+        self.overflowed = False
+        self._queue = queue.Queue(maxsize=max_pending)
+
+    def put(self, message):
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout=None):
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+# In-process publish/subscribe, one set of subscribers per channel name.
+# Anything with the same publish(channel, message) / subscribe(channel) / unsubscribe(subscription)
+# methods can stand in for it, e.g. RelayBroker below when running several worker processes.
+class LocalBroker(object):
+    def __init__(self, max_pending=100):
+        self.max_pending = max_pending
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel, self.max_pending)
+        with self._lock:
+            self._channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._channels.get(subscription.channel)
+            if (subscribers is not None):
+                subscribers.discard(subscription)
+                if (not subscribers):
+                    del self._channels[subscription.channel]
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put(message)
+        return len(subscribers)
+
+    def subscriber_count(self, channel=None):
+        with self._lock:
+            if (channel is not None):
+                return len(self._channels.get(channel, ()))
+            return sum(len(s) for s in self._channels.values())
+
+
+# Publish/subscribe across processes through a shared message store.
+# publish() only appends to the store. While a process has subscribers, one thread in it polls the store
+# every interval seconds and hands what's new to them, so a message published by any process reaches
+# subscribers in all of them, in the order the store gave it ids. A store has
+#   append(channel, message), last_id(), read(after_id) -> [(id, channel, message)] and prune(max_age)
+# Messages older than retention seconds are pruned now and then by whoever is publishing.
+class RelayBroker(LocalBroker):
+    def __init__(self, store, max_pending=100, interval=0.5, retention=60):
+        super(RelayBroker, self).__init__(max_pending)
+        self.store = store
+        self.interval = interval
+        self.retention = retention
+        self._poller = None
+        self._pruned_at = time.monotonic()
+
+    def subscribe(self, channel):
+        subscription = super(RelayBroker, self).subscribe(channel)
+        with self._lock:
+            # a thread object inherited across a fork isn't running in this process
+            if (self._poller is None or not self._poller.is_alive()):
+                self._poller = threading.Thread(target=self._poll, args=(self.store.last_id(),),
+                                                name='broker-relay', daemon=True)
+                self._poller.start()
+        return subscription
+
+    def publish(self, channel, message):
+        self.store.append(channel, message)
+        if (time.monotonic() - self._pruned_at > self.retention):
+            self._pruned_at = time.monotonic()
+            self.store.prune(self.retention)
+
+    def _poll(self, last_id):
+        while (True):
+            time.sleep(self.interval)
+            with self._lock:
+                # stops with the last subscriber, the next one starts from whatever is newest then
+                if (not self._channels):
+                    self._poller = None
+                    return
+            try:
+                messages = self.store.read(last_id)
+            except Exception:
+                # the store being briefly unavailable shouldn't end live updates, try again next time
+                continue
+            for id, channel, message in messages:
+                last_id = id
+                super(RelayBroker, self).publish(channel, message)
@@ -0,0 +1,59 @@
+from collections import namedtuple
+from functools import lru_cache
+from types import MappingProxyType
+
+
+# Derived character stats (5th edition rules)
+# Everything here is computed from level, the six ability scores and the save/skill proficiencies.
+
+ABILITIES = ['str', 'dex', 'con', 'int', 'wis', 'cha']
+
+SAVE_ABILITIES = {
+    'str_save': 'str', 'dex_save': 'dex', 'con_save': 'con',
+    'int_save': 'int', 'wis_save': 'wis', 'cha_save': 'cha',
+}
+
+SKILL_ABILITIES = {
+    'acrobatics': 'dex', 'animal_handling': 'wis', 'arcana': 'int', 'athletics': 'str',
+    'deception': 'cha', 'history': 'int', 'insight': 'wis', 'intimidation': 'cha',
+    'investigation': 'int', 'medicine': 'wis', 'nature': 'int', 'perception': 'wis',
+    'performance': 'cha', 'persuasion': 'cha', 'religion': 'int', 'sleight_of_hand': 'dex',
+    'stealth': 'dex', 'survival': 'wis',
+}
+
+# modifiers, saves and skills are read-only mappings, the same object is shared between callers
+DerivedStats = namedtuple('DerivedStats', ['modifiers', 'prof_bonus', 'saves', 'skills'])
+
+
+def ability_modifier(score):
+    if (score is None):
+        return None
+    return (score - 10) // 2
+
+
+def proficiency_bonus(level):
+    if (level is None):
+        return None
+    return 2 + (max(level, 1) - 1) // 4
+
+
+def bonus(modifier, prof_bonus, proficient):
+    if (modifier is None):
+        return None
+    if (proficient and prof_bonus is not None):
+        return modifier + prof_bonus
+    return modifier
+
+
+# Memoized on the inputs, so characters are only recomputed when one of them changes and
+# characters that share a build share the result.
+# scores is a tuple in ABILITIES order, proficient a frozenset of save/skill names.
+@lru_cache(maxsize=4096)
+def derive(level, scores, proficient):
+    modifiers = dict((ability, ability_modifier(score)) for ability, score in zip(ABILITIES, scores))
+    prof_bonus = proficiency_bonus(level)
+    saves = dict((save, bonus(modifiers[ability], prof_bonus, save in proficient))
+                 for save, ability in SAVE_ABILITIES.items())
+    skills = dict((skill, bonus(modifiers[ability], prof_bonus, skill in proficient))
+                  for skill, ability in SKILL_ABILITIES.items())
+    return DerivedStats(MappingProxyType(modifiers), prof_bonus, MappingProxyType(saves), MappingProxyType(skills))